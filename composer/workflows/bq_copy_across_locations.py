@@ -13,37 +13,62 @@
 # limitations under the License.
 
 """Example Airflow DAG that performs an export from BQ tables listed in
-config file to GCS, copies GCS objects across locations (e.g., from US to
-EU) then imports from GCS to BQ. The DAG imports the gcs_to_gcs operator
-from plugins and dynamically builds the tasks based on the list of tables.
-Lastly, the DAG defines a specific application logger to generate logs.
+config file to GCS, with one export job per table, copies GCS
+objects across locations (e.g., from US to EU) with a single Storage Transfer
+Service job then imports from GCS to BQ, with one load job per table. The DAG
+dynamically builds the tasks based on the list of tables. Lastly, the DAG
+defines a specific application logger to generate logs.
 
 This DAG relies on three Airflow variables
 https://airflow.apache.org/docs/apache-airflow/stable/concepts/variables.html:
 * table_list_file_path - CSV file listing source and target tables, including
-Datasets.
+Datasets. Preferably set as the AIRFLOW_VAR_TABLE_LIST_FILE_PATH environment
+variable of the Composer environment, which is read on every DAG parse.
 * gcs_source_bucket - Google Cloud Storage bucket to use for exporting
 BigQuery tables in source.
 * gcs_dest_bucket - Google Cloud Storage bucket to use for importing
 BigQuery tables in destination.
 See https://cloud.google.com/storage/docs/creating-buckets for creating a
-bucket.
+bucket. Each DAG run writes its objects under its own run ID prefix in both
+buckets, so an Object Lifecycle rule can be used to delete them
+https://cloud.google.com/storage/docs/lifecycle.
+
+The Storage Transfer Service job runs in the project of the Airflow Google
+Cloud connection, and copies the objects as the Storage Transfer Service agent
+of that project, not as the Composer service account. The agent needs read
+access on the source bucket and write access on the destination bucket, see
+https://cloud.google.com/storage-transfer/docs/source-cloud-storage and
+https://cloud.google.com/storage-transfer/docs/sink-cloud-storage.
+
+The DAG also relies on two Airflow pools
+https://airflow.apache.org/docs/apache-airflow/stable/administration-and-deployment/pools.html,
+which bound how many of its tasks run at the same time:
+* bq_export_pool - BigQuery export and load jobs, e.g. with 8 slots.
+* gcs_copy_pool - Copies across locations, e.g. with 32 slots.
+They can be created with, for example,
+`airflow pools set bq_export_pool 8 "BigQuery export and load jobs"`.
 """
 
 # --------------------------------------------------------------------------------
 # Load The Dependencies
 # --------------------------------------------------------------------------------
 
-import csv
+import collections
 import datetime
+import glob
+import hashlib
 import io
+import json
 import logging
+import mmap
+import os
+import stat
+import tempfile
 
 from airflow import models
+from airflow.models.baseoperator import chain
 from airflow.operators import dummy
-from airflow.providers.google.cloud.transfers import bigquery_to_gcs
-from airflow.providers.google.cloud.transfers import gcs_to_bigquery
-from airflow.providers.google.cloud.transfers import gcs_to_gcs
+from airflow.utils.dag_parsing_context import get_parsing_context
 
 
 # --------------------------------------------------------------------------------
@@ -53,11 +78,13 @@ from airflow.providers.google.cloud.transfers import gcs_to_gcs
 # If you are running Airflow in more than one time zone
 # see https://airflow.apache.org/docs/apache-airflow/stable/timezone.html
 # for best practices
-yesterday = datetime.datetime.now() - datetime.timedelta(days=1)
+# A fixed start date keeps the DAG definition identical across parses, unlike a
+# date computed from datetime.now()
+START_DATE = datetime.datetime(2024, 1, 1)
 
 default_args = {
     "owner": "airflow",
-    "start_date": yesterday,
+    "start_date": START_DATE,
     "depends_on_past": False,
     "email": [""],
     "email_on_failure": False,
@@ -77,6 +104,35 @@ source_bucket = "{{var.value.gcs_source_bucket}}"
 # Destination Bucket
 dest_bucket = "{{var.value.gcs_dest_bucket}}"
 
+# UTC start date of the task, as a Storage Transfer Service date. It is rendered
+# when the task runs, so a retried or cleared task schedules its transfer for
+# that day, and all three fields come from the same date
+transfer_date = {
+    "day": "{{ ti.start_date.day }}",
+    "month": "{{ ti.start_date.month }}",
+    "year": "{{ ti.start_date.year }}",
+}
+
+# Object name prefix of the tables exported by a DAG run
+run_prefix = "{{ run_id }}"
+
+# Airflow pools bounding the concurrent BigQuery export and load jobs, and the
+# concurrent GCS copies
+bq_export_pool = "bq_export_pool"
+gcs_copy_pool = "gcs_copy_pool"
+
+# DAG ID, also used to check whether this DAG is the one being parsed
+dag_id = "composer_sample_bq_copy_across_locations"
+
+# Prefix of the local directory caching the parsed table lists, one per user
+TABLE_LIST_CACHE_PREFIX = "bq_copy_tablelist_"
+
+# Size in bytes above which the table list file is memory mapped
+MMAP_MIN_FILE_SIZE = 1000000
+
+# Source and target tables of one line of the table list file
+TableRow = collections.namedtuple("TableRow", "src dst")
+
 # --------------------------------------------------------------------------------
 # Set GCP logging
 # --------------------------------------------------------------------------------
@@ -91,87 +147,310 @@ logger = logging.getLogger("bq_copy_us_to_eu_01")
 def read_table_list(table_list_file):
     """
     Reads the table list file that will help in creating Airflow tasks in
-    the DAG dynamically.
+    the DAG dynamically. The parsed list is cached on local disk, keyed by the
+    SHA256 of the file contents, so that an unchanged file is not parsed again.
     :param table_list_file: (String) The file location of the table list file,
     e.g. '/home/airflow/framework/table_list.csv'
-    :return table_list: (List) List of tuples containing the source and
+    :return table_list: (Tuple) TableRow tuples containing the source and
     target tables.
     """
-    table_list = []
-    logger.info("Reading table_list_file from : %s" % str(table_list_file))
+    logger.info("Reading table_list_file from : %s", table_list_file)
     try:
-        with io.open(table_list_file, "rt", encoding="utf-8") as csv_file:
-            csv_reader = csv.reader(csv_file)
-            next(csv_reader)  # skip the headers
-            for row in csv_reader:
-                logger.info(row)
-                table_tuple = {"table_source": row[0], "table_dest": row[1]}
-                table_list.append(table_tuple)
-            return table_list
+        csv_file = io.open(table_list_file, "rb")
     except IOError as e:
-        logger.error("Error opening table_list_file %s: " % str(table_list_file), e)
+        logger.error("Error opening table_list_file %s: %s", table_list_file, e)
+        return
+
+    # The file is hashed and parsed through the same open handle, so the rows
+    # cached under the digest are always those of the hashed file, even if the
+    # file is replaced in the meantime
+    with csv_file:
+        if os.fstat(csv_file.fileno()).st_size > MMAP_MIN_FILE_SIZE:
+            # Large files are hashed through a memory map, and later parsed
+            # the same way, instead of being copied into a bytes object
+            contents = None
+            with mmap.mmap(
+                csv_file.fileno(), 0, access=mmap.ACCESS_READ
+            ) as mapped_file:
+                digest = hashlib.sha256(mapped_file).hexdigest()
+        else:
+            contents = csv_file.read()
+            digest = hashlib.sha256(contents).hexdigest()
+
+        # Cache entries are named after the table list path and its contents,
+        # so that each table list only ever replaces its own previous entries
+        cache_dir = get_table_list_cache_dir()
+        path_digest = hashlib.sha256(
+            os.path.abspath(table_list_file).encode("utf-8")
+        ).hexdigest()
+        cache_file = None
+        if cache_dir is not None:
+            cache_file = os.path.join(
+                cache_dir, "{}_{}.json".format(path_digest, digest)
+            )
+            try:
+                with io.open(cache_file, "rt", encoding="utf-8") as f:
+                    return tuple(TableRow(*row) for row in json.load(f))
+            except (IOError, ValueError):
+                pass  # no usable cache entry, parse the file below
+
+        # pandas is only imported when the file actually has to be parsed
+        import pandas as pd
+
+        if contents is None:
+            csv_file.seek(0)
+        # The C parser of pandas does the row splitting, replacing the
+        # Python-level loop over csv.reader rows; the header row is replaced
+        # by the given names
+        table_df = pd.read_csv(
+            csv_file if contents is None else io.BytesIO(contents),
+            memory_map=contents is None,
+            usecols=[0, 1],
+            header=0,
+            names=["table_source", "table_dest"],
+            dtype="string",
+            # Missing cells stay empty strings, as they were with csv.reader
+            na_filter=False,
+            encoding="utf-8",
+            engine="c",
+        )
+    logger.info("Read %d tables from table_list_file", len(table_df))
+    table_list = tuple(
+        TableRow(*row) for row in table_df.itertuples(index=False, name=None)
+    )
+    # The rows now live in the tuple, so the data frame is freed before the
+    # cache is written and the tasks are built
+    del table_df
+
+    if cache_file is not None:
+        write_table_list_cache(cache_file, table_list)
+        # Entries for previous versions of this file will never be read again
+        stale_pattern = os.path.join(cache_dir, "{}_*.json".format(path_digest))
+        for stale_file in glob.glob(stale_pattern):
+            if stale_file != cache_file:
+                try:
+                    os.remove(stale_file)
+                except OSError:
+                    pass
+    return table_list
+
+
+def get_table_list_cache_dir():
+    """
+    Returns the directory caching parsed table lists, creating it if needed.
+    It is private to the current user, so that no other user can choose which
+    tables the DAG copies by planting a cache entry.
+    :return cache_dir: (String) The directory, or None if it is not private.
+    """
+    cache_dir = os.path.join(
+        tempfile.gettempdir(), "{}{}".format(TABLE_LIST_CACHE_PREFIX, os.getuid())
+    )
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        cache_dir_stat = os.lstat(cache_dir)
+    except OSError as e:
+        logger.warning("Error creating table list cache %s: %s", cache_dir, e)
+        return
+    if (
+        not stat.S_ISDIR(cache_dir_stat.st_mode)
+        or cache_dir_stat.st_uid != os.getuid()
+        or cache_dir_stat.st_mode & 0o077
+    ):
+        logger.warning("Not using table list cache %s, it is not private", cache_dir)
+        return
+    return cache_dir
+
+
+def write_table_list_cache(cache_file, table_list):
+    """
+    Writes a parsed table list to the cache. The entry is written to a
+    temporary file first and then moved into place, so that concurrent parses
+    never read a partially written entry.
+    :param cache_file: (String) The cache entry to write.
+    :param table_list: (Tuple) TableRow tuples, as returned by read_table_list.
+    """
+    try:
+        fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(cache_file), suffix=".tmp")
+    except OSError as e:
+        logger.warning("Error writing table list cache %s: %s", cache_file, e)
+        return
+    try:
+        with io.open(fd, "wt", encoding="utf-8") as f:
+            json.dump(table_list, f)
+        os.replace(temp_file, cache_file)
+    except OSError as e:
+        logger.warning("Error writing table list cache %s: %s", cache_file, e)
+        try:
+            os.remove(temp_file)
+        except OSError:
+            pass
 
 
 # --------------------------------------------------------------------------------
 # Main DAG
 # --------------------------------------------------------------------------------
 
-# Define a DAG (directed acyclic graph) of tasks.
-# Any task you create within the context manager is automatically added to the
-# DAG object.
-with models.DAG(
-    "composer_sample_bq_copy_across_locations",
-    default_args=default_args,
-    schedule_interval=None,
-) as dag:
-    start = dummy.DummyOperator(task_id="start", trigger_rule="all_success")
 
-    end = dummy.DummyOperator(task_id="end", trigger_rule="all_success")
+def build_dag():
+    """
+    Builds the DAG and its tasks from the table list file. The Google provider
+    operators are imported here instead of at the top of the file, so they are
+    only imported when this DAG is actually built.
+    :return dag: (DAG) The DAG.
+    """
+    from airflow.providers.google.cloud.hooks.cloud_storage_transfer_service import (
+        GcpTransferOperationStatus,
+    )
+    from airflow.providers.google.cloud.operators import cloud_storage_transfer_service
+    from airflow.providers.google.cloud.sensors import (
+        cloud_storage_transfer_service as cloud_storage_transfer_service_sensor,
+    )
+    from airflow.providers.google.cloud.transfers import bigquery_to_gcs
+    from airflow.providers.google.cloud.transfers import gcs_to_bigquery
 
     # 'table_list_file_path': This variable will contain the location of the main
-    # file. This is not part of an operator and cannot be templated, so it is included
-    # inside of the DAG instead of with the templated variables above
-    # to ensure the call to the DB only happens during DAG execution
-    table_list_file_path = models.Variable.get("table_list_file_path")
+    # file. This is not part of an operator and cannot be templated, so it is
+    # read while building the DAG.
+    # Set as the AIRFLOW_VAR_TABLE_LIST_FILE_PATH environment variable, the
+    # path is read without a lookup in the Airflow metadata database
+    table_list_file_path = os.environ.get(
+        "AIRFLOW_VAR_TABLE_LIST_FILE_PATH"
+    ) or models.Variable.get("table_list_file_path")
     # Get the table list from main file
     all_records = read_table_list(table_list_file_path)
-
-    # Loop over each record in the 'all_records' python list to build up
-    # Airflow tasks
-    for record in all_records:
-        logger.info("Generating tasks to transfer table: {}".format(record))
-
-        table_source = record["table_source"]
-        table_dest = record["table_dest"]
-
-        BQ_to_GCS = bigquery_to_gcs.BigQueryToGCSOperator(
-            # Replace ":" with valid character for Airflow task
-            task_id="{}_BQ_to_GCS".format(table_source.replace(":", "_")),
-            source_project_dataset_table=table_source,
-            destination_cloud_storage_uris=[
-                "{}-*.avro".format("gs://" + source_bucket + "/" + table_source)
-            ],
-            export_format="AVRO",
+    if all_records is None:
+        # read_table_list logged why the file could not be opened
+        raise IOError(
+            "Cannot build {}: table_list_file {} could not be read".format(
+                dag_id, table_list_file_path
+            )
         )
 
-        GCS_to_GCS = gcs_to_gcs.GCSToGCSOperator(
-            # Replace ":" with valid character for Airflow task
-            task_id="{}_GCS_to_GCS".format(table_source.replace(":", "_")),
-            source_bucket=source_bucket,
-            source_object="{}-*.avro".format(table_source),
-            destination_bucket=dest_bucket,
-            # destination_object='{}-*.avro'.format(table_dest)
-        )
+    # Define a DAG (directed acyclic graph) of tasks.
+    # Any task you create within the context manager is automatically added to the
+    # DAG object.
+    with models.DAG(
+        dag_id,
+        default_args=default_args,
+        schedule_interval=None,
+        # The number of tasks grows with the table list, so cap how many of
+        # them, and how many runs, are active at the same time
+        max_active_tasks=32,
+        max_active_runs=1,
+        dagrun_timeout=datetime.timedelta(hours=6),
+    ) as dag:
+        start = dummy.DummyOperator(task_id="start", trigger_rule="all_success")
+
+        end = dummy.DummyOperator(task_id="end", trigger_rule="all_success")
+
+        # Export and load tasks, one of each per table, wired together after the
+        # loop with the single copy of all tables
+        bq_to_gcs_tasks = []
+        gcs_to_bq_tasks = []
+        # Loop over each record in the 'all_records' python tuple to build up
+        # Airflow tasks
+        for table_source, table_dest in all_records:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Generating tasks to transfer table: %s", table_source)
+
+            # Exported objects of the table, relative to the bucket
+            source_objects = "{}/{}-*.parquet".format(run_prefix, table_source)
+
+            # Each table is exported by its own extract job, so the exports run in
+            # parallel, bounded by bq_export_pool. Tables are exported as ZSTD
+            # compressed Parquet, which is smaller than Avro for analytical
+            # schemas and so cuts the bytes copied across locations
+            BQ_to_GCS = bigquery_to_gcs.BigQueryToGCSOperator(
+                # Replace ":" with valid character for Airflow task
+                task_id="{}_BQ_to_GCS".format(table_source.replace(":", "_")),
+                pool=bq_export_pool,
+                source_project_dataset_table=table_source,
+                destination_cloud_storage_uris=[
+                    "gs://{}/{}".format(source_bucket, source_objects)
+                ],
+                export_format="PARQUET",
+                compression="ZSTD",
+            )
+            bq_to_gcs_tasks.append(BQ_to_GCS)
+
+            # Likewise, each table is loaded by its own load job, bounded by
+            # bq_export_pool, which replaces the table with the Parquet files
+            GCS_to_BQ = gcs_to_bigquery.GCSToBigQueryOperator(
+                # Replace ":" with valid character for Airflow task
+                task_id="{}_GCS_to_BQ".format(table_dest.replace(":", "_")),
+                pool=bq_export_pool,
+                bucket=dest_bucket,
+                source_objects=[source_objects],
+                destination_project_dataset_table=table_dest,
+                source_format="PARQUET",
+                write_disposition="WRITE_TRUNCATE",
+            )
+            gcs_to_bq_tasks.append(GCS_to_BQ)
+
+        # Without any table there is nothing to copy
+        if all_records:
+            # A single Storage Transfer Service job copies the objects of all tables
+            # server-side, instead of one GCS to GCS copy task per table. All tables
+            # are exported under the prefix of the DAG run, so one include prefix
+            # covers any number of tables. The job runs once, on the current date
+            GCS_to_GCS = cloud_storage_transfer_service.CloudDataTransferServiceCreateJobOperator(
+                task_id="GCS_to_GCS",
+                pool=gcs_copy_pool,
+                body={
+                    "description": dag_id,
+                    "status": "ENABLED",
+                    "schedule": {
+                        "scheduleStartDate": transfer_date,
+                        "scheduleEndDate": transfer_date,
+                    },
+                    "transferSpec": {
+                        "gcsDataSource": {"bucketName": source_bucket},
+                        "gcsDataSink": {"bucketName": dest_bucket},
+                        "objectConditions": {
+                            "includePrefixes": ["{}/".format(run_prefix)]
+                        },
+                        "transferOptions": {
+                            "overwriteObjectsAlreadyExistingInSink": True
+                        },
+                    },
+                },
+            )
+
+            # Polls the one transfer job, releasing its worker slot between pokes
+            wait_for_GCS_to_GCS = cloud_storage_transfer_service_sensor.CloudDataTransferServiceJobStatusSensor(
+                task_id="wait_for_GCS_to_GCS",
+                pool=gcs_copy_pool,
+                job_name="{{ task_instance.xcom_pull('GCS_to_GCS')['name'] }}",
+                expected_statuses={GcpTransferOperationStatus.SUCCESS},
+                mode="reschedule",
+            )
+
+            # Every DAG run creates a new transfer job, so it is deleted once it
+            # finished, whether it succeeded or not
+            delete_GCS_to_GCS = cloud_storage_transfer_service.CloudDataTransferServiceDeleteJobOperator(
+                task_id="delete_GCS_to_GCS",
+                pool=gcs_copy_pool,
+                job_name="{{ task_instance.xcom_pull('GCS_to_GCS')['name'] }}",
+                trigger_rule="all_done",
+            )
+
+            # start fans out to every export, all exports join on the copy, and the
+            # copy fans out to every load, which all join on end
+            chain(
+                start,
+                bq_to_gcs_tasks,
+                GCS_to_GCS,
+                wait_for_GCS_to_GCS,
+                gcs_to_bq_tasks,
+                end,
+            )
+            wait_for_GCS_to_GCS >> delete_GCS_to_GCS
+
+    return dag
 
-        GCS_to_BQ = gcs_to_bigquery.GCSToBigQueryOperator(
-            # Replace ":" with valid character for Airflow task
-            task_id="{}_GCS_to_BQ".format(table_dest.replace(":", "_")),
-            bucket=dest_bucket,
-            source_objects=["{}-*.avro".format(table_source)],
-            destination_project_dataset_table=table_dest,
-            source_format="AVRO",
-            write_disposition="WRITE_TRUNCATE",
-            autodetect=True,
-        )
 
-        start >> BQ_to_GCS >> GCS_to_GCS >> GCS_to_BQ >> end
+# The table list is only read, and the DAG only built, when the scheduler parses
+# every DAG (dag_id is None) or when a worker parses this DAG, never when another
+# DAG in the same file set is targeted
+if get_parsing_context().dag_id in (None, dag_id):
+    dag = build_dag()
@@ -14,6 +14,7 @@
 
 import os
 import os.path
+import tempfile
 
 from airflow import models
 
@@ -21,12 +22,14 @@ import internal_unit_testing
 import pytest
 
 
+EXAMPLE_FILE_PATH = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)),
+    'bq_copy_eu_to_us_sample.csv')
+
+
 @pytest.fixture(autouse=True, scope="function")
 def set_variables(airflow_database):
-    example_file_path = os.path.join(
-        os.path.abspath(os.path.dirname(__file__)),
-        'bq_copy_eu_to_us_sample.csv')
-    models.Variable.set('table_list_file_path', example_file_path)
+    models.Variable.set('table_list_file_path', EXAMPLE_FILE_PATH)
     models.Variable.set('gcs_source_bucket', 'example-project')
     models.Variable.set('gcs_dest_bucket', 'us-central1-f')
     yield
@@ -45,3 +48,95 @@ def test_dag():
 
     from . import bq_copy_across_locations as module
     internal_unit_testing.assert_has_valid_dag(module)
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """Keep the table list cache of each test in its own directory."""
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    yield tmp_path
+
+
+def test_read_table_list(cache_dir):
+    from . import bq_copy_across_locations as module
+
+    assert module.read_table_list(EXAMPLE_FILE_PATH) == (
+        ('nyc-tlc.green.trips_2014', 'nyc_tlc_EU.trips_2014'),
+        ('nyc-tlc.green.trips_2015', 'nyc_tlc_EU.trips_2015'),
+    )
+
+
+def test_read_table_list_missing_file(cache_dir, caplog):
+    from . import bq_copy_across_locations as module
+
+    missing_file = str(cache_dir / 'missing.csv')
+    assert module.read_table_list(missing_file) is None
+    assert 'Error opening table_list_file {}'.format(missing_file) in caplog.text
+
+
+def test_read_table_list_keeps_empty_cells(cache_dir):
+    from . import bq_copy_across_locations as module
+
+    table_list_file = cache_dir / 'table_list.csv'
+    table_list_file.write_text('Source, Target\nproject.dataset.table,\n')
+    assert module.read_table_list(str(table_list_file)) == (
+        ('project.dataset.table', ''),
+    )
+
+
+def test_read_table_list_uses_cache(cache_dir, monkeypatch):
+    import pandas
+    from . import bq_copy_across_locations as module
+
+    table_list = module.read_table_list(EXAMPLE_FILE_PATH)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('table list was parsed again')
+
+    monkeypatch.setattr(pandas, 'read_csv', fail)
+    assert module.read_table_list(EXAMPLE_FILE_PATH) == table_list
+
+
+def test_read_table_list_keeps_other_cache_entries(cache_dir):
+    from . import bq_copy_across_locations as module
+
+    other_file = cache_dir / 'other_table_list.csv'
+    other_file.write_text(u'Source, Target\nproject.a.b,dataset.c\n')
+    module.read_table_list(EXAMPLE_FILE_PATH)
+    module.read_table_list(str(other_file))
+
+    assert len(list(cache_dir.glob('bq_copy_tablelist_*/*.json'))) == 2
+
+
+def test_dag_dependencies(cache_dir):
+    from . import bq_copy_across_locations as module
+
+    dag = module.build_dag()
+    export_task_ids = {
+        'nyc-tlc.green.trips_2014_BQ_to_GCS',
+        'nyc-tlc.green.trips_2015_BQ_to_GCS',
+    }
+    load_task_ids = {
+        'nyc_tlc_EU.trips_2014_GCS_to_BQ',
+        'nyc_tlc_EU.trips_2015_GCS_to_BQ',
+    }
+
+    assert dag.get_task('start').downstream_task_ids == export_task_ids
+    for task_id in export_task_ids:
+        assert dag.get_task(task_id).downstream_task_ids == {'GCS_to_GCS'}
+        assert dag.get_task(task_id).pool == 'bq_export_pool'
+    copy_task = dag.get_task('GCS_to_GCS')
+    assert copy_task.upstream_task_ids == export_task_ids
+    assert copy_task.downstream_task_ids == {'wait_for_GCS_to_GCS'}
+    assert copy_task.pool == 'gcs_copy_pool'
+    wait_task = dag.get_task('wait_for_GCS_to_GCS')
+    assert wait_task.downstream_task_ids == load_task_ids | {'delete_GCS_to_GCS'}
+    assert wait_task.pool == 'gcs_copy_pool'
+    delete_task = dag.get_task('delete_GCS_to_GCS')
+    assert delete_task.upstream_task_ids == {'wait_for_GCS_to_GCS'}
+    assert delete_task.trigger_rule == 'all_done'
+    assert delete_task.pool == 'gcs_copy_pool'
+    for task_id in load_task_ids:
+        assert dag.get_task(task_id).upstream_task_ids == {'wait_for_GCS_to_GCS'}
+        assert dag.get_task(task_id).downstream_task_ids == {'end'}
+        assert dag.get_task(task_id).pool == 'bq_export_pool'
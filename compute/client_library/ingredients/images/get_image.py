@@ -32,6 +32,6 @@ def get_image(project_id: str, image_name: str) -> compute_v1.Image:
     Returns:
         An instance of compute_v1.Image object with information about specified image.
     """
-    image_client = compute_v1.ImagesClient()
+    image_client = get_images_client()
     return image_client.get(project=project_id, image=image_name)
 # </INGREDIENT>
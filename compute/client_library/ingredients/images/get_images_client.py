@@ -0,0 +1,35 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This is an ingredient file. It is not meant to be run directly. Check the samples/snippets 
+# folder for complete code samples that are ready to be used.
+# Disabling flake8 for the ingredients file, as it would fail F821 - undefined name check.
+# flake8: noqa
+import functools
+
+from google.cloud import compute_v1
+
+
+# <INGREDIENT get_images_client>
+@functools.lru_cache(maxsize=None)
+def get_images_client() -> compute_v1.ImagesClient:
+    """
+    Return an ImagesClient shared by all image lookups in this process, so that
+    the connection and credentials are set up only once.
+
+    Returns:
+        An instance of compute_v1.ImagesClient.
+    """
+    return compute_v1.ImagesClient()
+# </INGREDIENT>
@@ -16,6 +16,8 @@
 # <REGION compute_images_get_from_family>
 # <REGION compute_images_get>
 # <IMPORTS/>
+
+# <INGREDIENT get_images_client />
 # </REGION compute_images_get>
 
 
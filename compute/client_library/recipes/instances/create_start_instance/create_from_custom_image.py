@@ -16,6 +16,8 @@
 # <REGION compute_instances_create_from_custom_image>
 # <IMPORTS/>
 
+# <INGREDIENT get_images_client />
+
 # <INGREDIENT get_image_from_family />
 
 
@@ -17,6 +17,8 @@
 # <REGION compute_create_windows_instance_internal_ip>
 # <IMPORTS/>
 
+# <INGREDIENT get_images_client />
+
 # <INGREDIENT get_image_from_family />
 
 
@@ -17,6 +17,8 @@
 # <REGION compute_instances_create_from_image_plus_snapshot_disk>
 # <IMPORTS/>
 
+# <INGREDIENT get_images_client />
+
 # <INGREDIENT get_image_from_family />
 
 
@@ -16,6 +16,8 @@
 # <REGION compute_instances_create_with_subnet>
 # <IMPORTS/>
 
+# <INGREDIENT get_images_client />
+
 # <INGREDIENT get_image_from_family />
 
 
@@ -20,6 +20,8 @@
 # <INGREDIENT custom_machine_type_helper_class />
 
 
+# <INGREDIENT get_images_client />
+
 # <INGREDIENT get_image_from_family />
 
 
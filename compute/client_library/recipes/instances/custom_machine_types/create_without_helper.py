@@ -16,6 +16,8 @@
 # <REGION compute_custom_machine_type_create_without_helper>
 # <IMPORTS/>
 
+# <INGREDIENT get_images_client />
+
 # <INGREDIENT get_image_from_family />
 
 
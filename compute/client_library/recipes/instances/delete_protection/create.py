@@ -16,6 +16,8 @@
 # <REGION compute_delete_protection_create>
 # <IMPORTS/>
 
+# <INGREDIENT get_images_client />
+
 # <INGREDIENT get_image_from_family />
 
 
@@ -16,6 +16,8 @@
 # <REGION compute_spot_create>
 # <IMPORTS/>
 
+# <INGREDIENT get_images_client />
+
 # <INGREDIENT get_image_from_family />
 
 
@@ -21,8 +21,23 @@
 
 # [START compute_images_get_from_family]
 # [START compute_images_get]
+import functools
+
 from google.cloud import compute_v1
 
+
+@functools.lru_cache(maxsize=None)
+def get_images_client() -> compute_v1.ImagesClient:
+    """
+    Return an ImagesClient shared by all image lookups in this process, so that
+    the connection and credentials are set up only once.
+
+    Returns:
+        An instance of compute_v1.ImagesClient.
+    """
+    return compute_v1.ImagesClient()
+
+
 # [END compute_images_get]
 
 
@@ -37,7 +52,7 @@ def get_image_from_family(project: str, family: str) -> compute_v1.Image:
     Returns:
         An Image object.
     """
-    image_client = compute_v1.ImagesClient()
+    image_client = get_images_client()
     # List of public operating system (OS) images: https://cloud.google.com/compute/docs/images/os-details
     newest_image = image_client.get_from_family(project=project, family=family)
     return newest_image
@@ -58,7 +73,7 @@ def get_image(project_id: str, image_name: str) -> compute_v1.Image:
     Returns:
         An instance of compute_v1.Image object with information about specified image.
     """
-    image_client = compute_v1.ImagesClient()
+    image_client = get_images_client()
     return image_client.get(project=project_id, image=image_name)
 
 
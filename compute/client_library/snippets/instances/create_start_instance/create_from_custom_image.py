@@ -20,6 +20,7 @@
 
 
 # [START compute_instances_create_from_custom_image]
+import functools
 import re
 import sys
 from typing import Any, List
@@ -29,6 +30,18 @@ from google.api_core.extended_operation import ExtendedOperation
 from google.cloud import compute_v1
 
 
+@functools.lru_cache(maxsize=None)
+def get_images_client() -> compute_v1.ImagesClient:
+    """
+    Return an ImagesClient shared by all image lookups in this process, so that
+    the connection and credentials are set up only once.
+
+    Returns:
+        An instance of compute_v1.ImagesClient.
+    """
+    return compute_v1.ImagesClient()
+
+
 def get_image_from_family(project: str, family: str) -> compute_v1.Image:
     """
     Retrieve the newest image that is part of a given family in a project.
@@ -40,7 +53,7 @@ def get_image_from_family(project: str, family: str) -> compute_v1.Image:
     Returns:
         An Image object.
     """
-    image_client = compute_v1.ImagesClient()
+    image_client = get_images_client()
     # List of public operating system (OS) images: https://cloud.google.com/compute/docs/images/os-details
     newest_image = image_client.get_from_family(project=project, family=family)
     return newest_image